@@ -1,132 +1,574 @@
-import streamlit as st
 import os
+# Pin TensorFlow to the first GPU; must be set before deepface imports TF
+os.environ.setdefault("CUDA_VISIBLE_DEVICES", "0")
+
+import streamlit as st
 import datetime
-import json
-import pandas as pd
+import sqlite3
+import tempfile
+import shutil
+import time
+import atexit
+import hashlib
+import hmac
+import logging
+from contextlib import closing
+try:
+    import orjson
+except ImportError:
+    orjson = None
+    try:
+        import ujson as json
+    except ImportError:
+        import json
 import cv2
 import numpy as np
 from PIL import Image
-from io import BytesIO
+import threading
+import queue
+from concurrent.futures import ThreadPoolExecutor
+import tensorflow as tf
 from deepface import DeepFace
+import av
+from streamlit_webrtc import webrtc_streamer, WebRtcMode
+from theme import LIGHT_CSS, DARK_CSS
+
+try:
+    import onnxruntime as ort
+except ImportError:
+    ort = None
+
+logger = logging.getLogger(__name__)
 
 # --- 1. SETUP & CONFIGURATION ---
 LOGO_PATH = "images/NautilusLogoDesign.png"
 USER_DB_FILE = "users.json"
-SCANS_DB_FILE = "scans.json" 
+DEFAULT_ADMIN = ("admin", "1234")  # seeded, hashed, into a new users.json
+SCANS_DB_FILE = "scans.db"
+LEGACY_SCANS_FILE = "scans.json"  # imported into SCANS_DB_FILE on first run
+SCAN_FLUSH_INTERVAL = 0.1  # seconds the writer waits to batch saves into one commit
 SCANS_DIR = "scanned_images" 
 FACE_DB_DIR = "face_db"
-
-os.makedirs(SCANS_DIR, exist_ok=True)
-os.makedirs(FACE_DB_DIR, exist_ok=True)
+IO_BUFFER_SIZE = 64 * 1024
+WEBP_QUALITY = 82
+THUMB_SIZE = (400, 400)
+THUMB_QUALITY = 75
+MAX_IMAGE_PIXELS = 50_000_000  # Pillow decompression-bomb limit for stored scans
+MODELS_DIR = "models"  # FP16 ONNX exports written by export_onnx.py
+YUNET_MODEL_PATH = os.path.join(MODELS_DIR, "face_detection_yunet_2023mar.onnx")
+
+ATTRIBUTE_MODELS = ("Emotion", "Age", "Gender")
+ONNX_PROVIDERS = ["TensorrtExecutionProvider", "CUDAExecutionProvider", "CPUExecutionProvider"]
+RECOGNITION_MODEL = "Facenet512"
+EMBEDDING_DIM = 512
+MATCH_THRESHOLD = 0.70  # cosine similarity; DeepFace's Facenet512 cosine distance cut-off is 0.30
+INDEX_EMBEDDINGS_FILE = "embeddings.npy"
+INDEX_LABELS_FILE = "labels.json"
+PARALLEL_SEARCH_MIN_ROWS = 8192  # below this one BLAS call beats thread hand-off
+FACE_CROP_SIZE = 224  # training images are stored as face crops of this size
+FACE_CROP_JPEG_QUALITY = 85
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+YUNET_SCORE_THRESHOLD = 0.9
+ANALYSIS_MAX_SIDE = 640  # longest side of the frame the detector and attribute models see
+EMOTION_LABELS = ["angry", "disgust", "fear", "happy", "sad", "surprise", "neutral"]
+GENDER_LABELS = ["Woman", "Man"]
+LABEL_FONT = cv2.FONT_HERSHEY_SIMPLEX
+LABEL_FONT_SCALE = 0.8
+LABEL_THICKNESS = 2
+
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS
+
+@st.cache_resource(show_spinner=False)
+def init_storage():
+    """Create the top-level folders and look for the logo once per process, not on every rerun."""
+    os.makedirs(SCANS_DIR, exist_ok=True)
+    os.makedirs(FACE_DB_DIR, exist_ok=True)
+    return os.path.exists(LOGO_PATH)
+
+LOGO_EXISTS = init_storage()
+
+def ensure_dir(path):
+    """os.makedirs, skipped for folders already created earlier in this session."""
+    made_dirs = st.session_state.setdefault("made_dirs", set())
+    if path not in made_dirs:
+        os.makedirs(path, exist_ok=True)
+        made_dirs.add(path)
 
 st.set_page_config(
     page_title="Nautilus AI",
-    page_icon=LOGO_PATH if os.path.exists(LOGO_PATH) else "⚓",
+    page_icon=LOGO_PATH if LOGO_EXISTS else "⚓",
     layout="wide"
 )
 
 # --- 2. DATA MANAGEMENT (PERSISTENCE) ---
+# orjson when installed; otherwise ujson or the stdlib behind the same bytes-in/bytes-out helpers
+if orjson is not None:
+    def json_dumps(data):
+        return orjson.dumps(data, option=orjson.OPT_APPEND_NEWLINE)
+    json_loads = orjson.loads
+    JSONDecodeError = orjson.JSONDecodeError
+else:
+    def json_dumps(data):
+        return (json.dumps(data) + "\n").encode("utf-8")
+    json_loads = json.loads
+    JSONDecodeError = ValueError  # json's and ujson's decode errors both subclass it
+
 def load_json_db(filepath, default_data):
-    if not os.path.exists(filepath):
-        with open(filepath, "w") as f:
-            json.dump(default_data, f)
+    # One stat tells us both "missing" and "empty"; only real content is parsed
+    try:
+        size = os.path.getsize(filepath)
+    except FileNotFoundError:
+        save_json_db(filepath, default_data)
+        return default_data
+    if size == 0:
         return default_data
-    else:
-        try:
-            with open(filepath, "r") as f:
-                return json.load(f)
-        except:
-            return default_data
+
+    try:
+        with open(filepath, "rb", buffering=IO_BUFFER_SIZE) as f:
+            return json_loads(f.read())
+    except JSONDecodeError:
+        return default_data
+
+@st.cache_resource(show_spinner=False)
+def default_file_mode():
+    """Mode a plain open() would create files with; os.umask can only be read by setting it."""
+    umask = os.umask(0o022)
+    os.umask(umask)
+    return 0o666 & ~umask
 
 def save_json_db(filepath, data):
-    with open(filepath, "w") as f:
-        json.dump(data, f)
+    # NamedTemporaryFile is always 0600, so the swapped-in file takes the old file's mode (or the umask default)
+    try:
+        mode = os.stat(filepath).st_mode & 0o777
+    except FileNotFoundError:
+        mode = default_file_mode()
+
+    # Write a temp file next to the target and swap it in, so a crash never leaves a half-written DB
+    with tempfile.NamedTemporaryFile("wb", buffering=IO_BUFFER_SIZE,
+                                     dir=os.path.dirname(filepath) or ".", delete=False) as tmp:
+        try:
+            tmp.write(json_dumps(data))
+            # Data must be on disk before the rename, or a crash could swap in an empty file
+            tmp.flush()
+            os.fsync(tmp.fileno())
+            os.chmod(tmp.name, mode)
+        except BaseException:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+    os.replace(tmp.name, filepath)
+    # Two writes inside one mtime tick would otherwise leave a stale entry behind
+    load_json_cached.clear()
+
+def file_version(filepath):
+    """(mtime in ns, size) of a file, or None if it's missing; changes on every write."""
+    try:
+        info = os.stat(filepath)
+    except OSError:
+        return None
+    return (info.st_mtime_ns, info.st_size)
+
+@st.cache_data(show_spinner=False)
+def load_json_cached(filepath, version, default_json):
+    """
+    load_json_db memoised on the file's version, so reruns only re-read after a write.
+    The default is passed as a JSON string to keep the cache key cheap to hash.
+    """
+    return load_json_db(filepath, json_loads(default_json))
 
 # --- USER MANAGEMENT ---
 def load_users():
-    return load_json_db(USER_DB_FILE, {"admin": "1234"})
+    version = file_version(USER_DB_FILE)
+    if version is None:
+        # A fresh install gets the default account already hashed, so no plaintext password is ever written
+        username, password = DEFAULT_ADMIN
+        save_json_db(USER_DB_FILE, {username: hash_password(password)})
+        version = file_version(USER_DB_FILE)
+    return load_json_cached(USER_DB_FILE, version, "{}")
+
+def hash_password(password, salt=None):
+    """scrypt hash of a password, as the {"salt", "hash"} record stored in users.json (~50 ms)."""
+    salt = os.urandom(16) if salt is None else salt
+    digest = hashlib.scrypt(password.encode("utf-8"), salt=salt, n=2**14, r=8, p=1)
+    return {"salt": salt.hex(), "hash": digest.hex()}
+
+def verify_password(stored, password):
+    if isinstance(stored, str):
+        # Legacy plaintext entry; login_page re-saves it hashed after a successful match
+        return hmac.compare_digest(stored.encode("utf-8"), password.encode("utf-8"))
+    expected = hash_password(password, bytes.fromhex(stored["salt"]))["hash"]
+    return hmac.compare_digest(expected, stored["hash"])
+
+def session_users():
+    """session_state.user_db, re-read only when users.json has changed since this session last saw it."""
+    version = file_version(USER_DB_FILE)
+    if st.session_state.get("user_db_version") != version:
+        st.session_state.user_db = load_users()
+        st.session_state.user_db_version = version
+    return st.session_state.user_db
 
 def save_new_user(username, password):
     db = load_users()
-    db[username] = password
+    db[username] = hash_password(password)
     save_json_db(USER_DB_FILE, db)
     st.session_state.user_db = db
+    st.session_state.user_db_version = file_version(USER_DB_FILE)
 
 # --- SCAN MANAGEMENT ---
-def load_scans():
-    return load_json_db(SCANS_DB_FILE, [])
+# Column aliases keep scan records shaped like the old scans.json entries
+# filepath is left NULL on new rows: the path always follows from user and filename (see scan_path)
+SCAN_COLUMNS = ('date AS "Date", user AS "User", emotion AS "Emotion", status AS "Status", '
+                'filename AS "File Name"')
+INSERT_SCAN = ("INSERT INTO scans (date, user, emotion, status, filename) "
+               "VALUES (?, ?, ?, ?, ?)")
+
+def connect_scans_db():
+    conn = sqlite3.connect(SCANS_DB_FILE)
+    conn.row_factory = sqlite3.Row
+    # In WAL mode, NORMAL only syncs at checkpoints and stays crash-safe
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+def scan_row(record):
+    return (record.get("Date"), record.get("User"), record.get("Emotion"),
+            record.get("Status"), record.get("File Name"))
+
+@st.cache_resource(show_spinner=False)
+def init_scans_db():
+    """Create the scans table once per process; the first run also imports scans.json."""
+    with closing(connect_scans_db()) as conn:
+        # Write-ahead logging: each commit is appended to scans.db-wal instead of rewriting pages
+        # through a rollback journal. The setting is stored in the file, so this runs once per database.
+        conn.execute("PRAGMA journal_mode = WAL")
+
+    with closing(connect_scans_db()) as conn, conn:
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS scans (
+                id INTEGER PRIMARY KEY,
+                date TEXT,
+                user TEXT,
+                emotion TEXT,
+                status TEXT,
+                filename TEXT,
+                filepath TEXT
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_user ON scans(user)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_user_filename ON scans(user, filename)")
+
+        # user_version marks the import as done, so deleting every scan doesn't bring the JSON history back
+        if conn.execute("PRAGMA user_version").fetchone()[0] == 0:
+            if os.path.exists(LEGACY_SCANS_FILE):
+                conn.executemany(INSERT_SCAN, [scan_row(r) for r in load_json_db(LEGACY_SCANS_FILE, [])])
+            conn.execute("PRAGMA user_version = 1")
+
+def scans_db_version():
+    # WAL commits land in the -wal file and only reach scans.db at checkpoints, so both count
+    return file_version(SCANS_DB_FILE), file_version(SCANS_DB_FILE + "-wal")
+
+@st.cache_data(show_spinner=False)
+def query_scans(username, version):
+    """A user's scans, memoised on the database version (see scans_db_version)."""
+    with closing(connect_scans_db()) as conn:
+        rows = conn.execute(f"SELECT {SCAN_COLUMNS} FROM scans WHERE user = ? ORDER BY id",
+                            (username,)).fetchall()
+    return [dict(row) for row in rows]
+
+def write_pending_scans(pending, failed, failed_lock):
+    """Writer thread: commits queued records in batches, one transaction per burst of saves."""
+    while True:
+        batch = [pending.get()]
+        try:
+            time.sleep(SCAN_FLUSH_INTERVAL)
+            while True:
+                try: batch.append(pending.get_nowait())
+                except queue.Empty: break
+            with closing(connect_scans_db()) as conn, conn:
+                conn.executemany(INSERT_SCAN, [scan_row(r) for r in batch])
+            query_scans.clear()
+        except Exception:
+            # Keep the thread alive; load_scans reports the lost records to their user
+            logger.exception("Could not save %d scan record(s)", len(batch))
+            with failed_lock:
+                failed.extend(batch)
+        finally:
+            for _ in batch:
+                pending.task_done()
+
+@st.cache_resource(show_spinner=False)
+def get_scan_writer():
+    pending, failed, failed_lock = queue.Queue(), [], threading.Lock()
+    threading.Thread(target=write_pending_scans, args=(pending, failed, failed_lock), daemon=True).start()
+    # Daemon threads still run during atexit, so records queued just before shutdown get written
+    atexit.register(pending.join)
+    return pending, failed, failed_lock
+
+def flush_scans(username):
+    """
+    Wait for queued records to be committed, so reads see this session's own saves.
+    Returns this user's records whose commit failed since the last call.
+    """
+    pending, failed, failed_lock = get_scan_writer()
+    pending.join()
+    with failed_lock:
+        mine = [r for r in failed if r.get("User") == username]
+        failed[:] = [r for r in failed if r.get("User") != username]
+    return mine
+
+def load_scans(username):
+    lost = flush_scans(username)
+    if lost:
+        names = ", ".join(r.get("File Name", "?") for r in lost)
+        st.error(f"{len(lost)} scan record(s) could not be saved and are missing below: {names}. "
+                 f"The image files are still in {os.path.join(SCANS_DIR, username)}.")
+    return query_scans(username, scans_db_version())
 
 def save_scan_record(record):
-    history = load_scans()
-    history.append(record)
-    save_json_db(SCANS_DB_FILE, history)
-    st.session_state.scan_history = history
+    get_scan_writer()[0].put(record)
 
-def save_image_locally(uploaded_file, username):
-    """Saves image to a user-specific subfolder."""
+init_scans_db()
+
+def scan_files(username):
+    """Names in a user's scan folder, listed once with scandir and reused until a save or delete."""
+    listings = st.session_state.setdefault("scan_files", {})
+    if username not in listings:
+        try:
+            with os.scandir(os.path.join(SCANS_DIR, username)) as entries:
+                listings[username] = {e.name for e in entries}
+        except FileNotFoundError:
+            listings[username] = set()
+    return listings[username]
+
+def forget_scan_files(username):
+    st.session_state.setdefault("scan_files", {}).pop(username, None)
+
+def scan_path(username, filename):
+    return os.path.join(SCANS_DIR, username, filename)
+
+def thumb_path(filepath):
+    return filepath + ".thumb.webp"
+
+def save_image_locally(uploaded_file, username, image_bgr):
+    """
+    Saves image to a user-specific subfolder, re-encoded as WebP.
+    image_bgr is the upload as already decoded (and size-checked) by decode_upload.
+    """
     user_folder = os.path.join(SCANS_DIR, username)
-    os.makedirs(user_folder, exist_ok=True)
+    ensure_dir(user_folder)
     
     timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    ext = os.path.splitext(uploaded_file.name)[1] if hasattr(uploaded_file, 'name') else ".jpg"
-    filename = f"scan_{timestamp}{ext}"
-    filepath = os.path.join(user_folder, filename)
+    ext = os.path.splitext(uploaded_file.name)[1].lower() if hasattr(uploaded_file, 'name') else ".jpg"
+    filename = f"scan_{timestamp}.webp"
+    filepath = scan_path(username, filename)
     
-    with open(filepath, "wb") as f:
-        f.write(uploaded_file.getbuffer())
-        
+    img = Image.fromarray(cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB))
+
+    if ext == ".webp":
+        # Already WebP: stream the original across in IO_BUFFER_SIZE chunks
+        uploaded_file.seek(0)
+        with open(filepath, "wb", buffering=IO_BUFFER_SIZE) as f:
+            shutil.copyfileobj(uploaded_file, f, IO_BUFFER_SIZE)
+    else:
+        img.save(filepath, format="WEBP", quality=WEBP_QUALITY, method=4)
+
+    # Small preview for the Storage page, so it never has to load the full image
+    img.thumbnail(THUMB_SIZE, Image.Resampling.LANCZOS)
+    img.save(thumb_path(filepath), format="WEBP", quality=THUMB_QUALITY)
+
+    forget_scan_files(username)
     return filename, filepath
 
-def delete_scan_by_filename(filename_to_delete):
-    full_history = st.session_state.scan_history
-    record_to_delete = next((item for item in full_history if item["File Name"] == filename_to_delete), None)
-    
-    if record_to_delete:
-        index = full_history.index(record_to_delete)
-        file_path = record_to_delete.get("File Path")
-        
-        if file_path and os.path.exists(file_path):
+def delete_scan_by_filename(filename_to_delete, username):
+    get_scan_writer()[0].join()
+    with closing(connect_scans_db()) as conn, conn:
+        # One index seek finds the row; it is then deleted by rowid
+        record_to_delete = conn.execute("SELECT id FROM scans WHERE user = ? AND filename = ?",
+                                        (username, filename_to_delete)).fetchone()
+        if record_to_delete is None:
+            return
+
+        file_path = scan_path(username, filename_to_delete)
+        if os.path.exists(file_path):
             try: os.remove(file_path)
             except Exception as e: st.error(f"Error deleting file: {e}")
-        
-        full_history.pop(index)
-        save_json_db(SCANS_DB_FILE, full_history)
-        st.session_state.scan_history = full_history
-        st.success("Record and image deleted.")
-        st.rerun()
+        if os.path.exists(thumb_path(file_path)):
+            try: os.remove(thumb_path(file_path))
+            except Exception as e: st.error(f"Error deleting thumbnail: {e}")
+
+        conn.execute("DELETE FROM scans WHERE id = ?", (record_to_delete["id"],))
+    query_scans.clear()
+    forget_scan_files(username)
+
+    st.success("Record and image deleted.")
+    st.rerun()
 
 # --- DEEPFACE HELPERS ---
-def pil_to_cv2(pil_image):
-    """Convert PIL Image to OpenCV BGR numpy array."""
-    rgb = np.array(pil_image.convert("RGB"))
-    bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
-    return bgr
+def enable_gpu_memory_growth():
+    """Let TensorFlow allocate GPU memory on demand instead of grabbing all of it."""
+    for gpu in tf.config.list_physical_devices("GPU"):
+        try:
+            tf.config.experimental.set_memory_growth(gpu, True)
+        except RuntimeError:
+            pass  # GPU was already initialised by an earlier model
 
-def cv2_to_pil(cv2_image):
-    """Convert OpenCV BGR numpy array to PIL Image."""
-    rgb = cv2.cvtColor(cv2_image, cv2.COLOR_BGR2RGB)
-    return Image.fromarray(rgb)
+@st.cache_resource(show_spinner="Loading face analysis models...")
+def get_attribute_model(name):
+    """
+    Build one DeepFace attribute model once per process and keep it in memory.
+    Only needed for models without an ONNX export (see predict_batch).
+    """
+    enable_gpu_memory_growth()
+    return DeepFace.build_model(model_name=name, task="facial_attribute")
+
+@st.cache_resource(show_spinner=False)
+def get_onnx_sessions():
+    """Open an ONNX Runtime session for each attribute model exported to MODELS_DIR."""
+    if ort is None:
+        return {}
+    available = ort.get_available_providers()
+    providers = [p for p in ONNX_PROVIDERS if p in available]
+    sessions = {}
+    for name in ATTRIBUTE_MODELS:
+        path = os.path.join(MODELS_DIR, f"{name.lower()}_fp16.onnx")
+        if os.path.exists(path):
+            sessions[name] = ort.InferenceSession(path, providers=providers)
+    return sessions
+
+@st.cache_resource(show_spinner=False)
+def get_face_detector():
+    """
+    YuNet (OpenCV's SIMD-optimised port of libfacedetection) when its weights
+    are in MODELS_DIR, otherwise the Haar cascade. Returns (detector, lock);
+    the lock guards YuNet's input size, which is set per frame.
+    """
+    if hasattr(cv2, "FaceDetectorYN") and os.path.exists(YUNET_MODEL_PATH):
+        detector = cv2.FaceDetectorYN.create(YUNET_MODEL_PATH, "", (320, 320), YUNET_SCORE_THRESHOLD)
+    else:
+        detector = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
+    return detector, threading.Lock()
+
+def detect_faces(image_bgr):
+    """Return an (x, y, w, h) box for every face found in a BGR image."""
+    detector, lock = get_face_detector()
+    if isinstance(detector, cv2.CascadeClassifier):
+        gray = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY)
+        boxes = detector.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5, minSize=(30, 30))
+        return [tuple(int(v) for v in box) for box in boxes]
+
+    img_h, img_w = image_bgr.shape[:2]
+    with lock:
+        detector.setInputSize((img_w, img_h))
+        _, faces = detector.detect(image_bgr)
+    if faces is None:
+        return []
+
+    # YuNet boxes can spill past the frame edge, so clip them
+    boxes = []
+    for x, y, w, h in faces[:, :4].astype(int):
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, img_w), min(y + h, img_h)
+        if x1 > x0 and y1 > y0:
+            boxes.append((int(x0), int(y0), int(x1 - x0), int(y1 - y0)))
+    return boxes
+
+def largest_face_box(image_bgr):
+    """Biggest detected face, or the whole frame when none is found (e.g. an already-cropped face)."""
+    boxes = detect_faces(image_bgr)
+    if not boxes:
+        h, w = image_bgr.shape[:2]
+        return (0, 0, w, h)
+    return max(boxes, key=lambda box: box[2] * box[3])
+
+def predict_batch(name, batch):
+    """
+    Run an attribute model over a whole NHWC batch in one call.
+    Uses the FP16 ONNX export when present, the Keras model otherwise.
+    """
+    session = get_onnx_sessions().get(name)
+    if session is not None:
+        feed = {session.get_inputs()[0].name: batch.astype(np.float16)}
+        return session.run(None, feed)[0].astype(np.float32)
+    model = get_attribute_model(name).model
+    return model.predict(batch, batch_size=len(batch), verbose=0)
+
+def analyze_faces(image_bgr, boxes):
+    """
+    Run emotion, age and gender over all face crops as one batch per model.
+    Returns one dict per box, shaped like DeepFace.analyze() output.
+    """
+    crops = [image_bgr[y:y + h, x:x + w] for x, y, w, h in boxes]
+
+    # Emotion model expects 48x48 grayscale, age/gender expect 224x224 BGR, all scaled to [0, 1]
+    emotion_batch = np.stack([cv2.resize(cv2.cvtColor(c, cv2.COLOR_BGR2GRAY), (48, 48)) for c in crops])
+    emotion_batch = emotion_batch[..., np.newaxis].astype(np.float32) / 255.0
+    face_batch = np.stack([cv2.resize(c, (224, 224)) for c in crops]).astype(np.float32) / 255.0
+
+    emotion_preds = predict_batch("Emotion", emotion_batch)
+    age_preds = predict_batch("Age", face_batch)
+    gender_preds = predict_batch("Gender", face_batch)
+
+    results = []
+    for (x, y, w, h), emo, age, gen in zip(boxes, emotion_preds, age_preds, gender_preds):
+        results.append({
+            "region": {"x": x, "y": y, "w": w, "h": h},
+            "emotion": {label: float(100 * p / emo.sum()) for label, p in zip(EMOTION_LABELS, emo)},
+            "dominant_emotion": EMOTION_LABELS[int(np.argmax(emo))],
+            "age": int(np.dot(age, np.arange(len(age)))),
+            "gender": {label: float(100 * p) for label, p in zip(GENDER_LABELS, gen)},
+            "dominant_gender": GENDER_LABELS[int(np.argmax(gen))],
+        })
+    return results
+
+def decode_upload(uploaded_file):
+    """
+    Decode an uploaded/captured image straight to an OpenCV BGR array.
+    getbuffer() is a view over the upload's bytes, so there is no extra copy before imdecode.
+    Returns None if the bytes are not a readable image or exceed MAX_IMAGE_PIXELS.
+    """
+    uploaded_file.seek(0)
+    try:
+        # Image.open only parses the header, so oversized images are refused before any pixels are decoded
+        with Image.open(uploaded_file) as img:
+            if img.width * img.height > MAX_IMAGE_PIXELS:
+                return None
+    except (Image.UnidentifiedImageError, Image.DecompressionBombError):
+        return None
+    return cv2.imdecode(np.frombuffer(uploaded_file.getbuffer(), dtype=np.uint8), cv2.IMREAD_COLOR)
+
+@st.cache_resource(show_spinner=False)
+def get_label_sizes():
+    """Pixel size of every emotion label in the label font, measured once per process."""
+    return {label: cv2.getTextSize(label, LABEL_FONT, LABEL_FONT_SCALE, LABEL_THICKNESS)[0]
+            for label in EMOTION_LABELS}
 
 def annotate_faces(image_bgr):
     """
-    Run DeepFace.analyze() for emotion, age, gender.
+    Detect faces, then run emotion, age and gender on all of them in one batch.
     Draw bounding boxes and emotion labels on the image.
-    Returns (annotated_bgr, results_list).
+    Returns (annotated_bgr, results_list, error).
     """
+    # Analyse a copy no larger than ANALYSIS_MAX_SIDE; boxes are scaled back for drawing
+    scale = ANALYSIS_MAX_SIDE / max(image_bgr.shape[:2])
+    if scale < 1:
+        small = cv2.resize(image_bgr, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    else:
+        small, scale = image_bgr, 1.0
+
     try:
-        results = DeepFace.analyze(
-            img_path=image_bgr,
-            actions=['emotion', 'age', 'gender'],
-            enforce_detection=False,
-            detector_backend='opencv'
-        )
+        boxes = detect_faces(small)
+        results = analyze_faces(small, boxes) if boxes else []
     except Exception as e:
         return image_bgr, [], str(e)
 
-    if not isinstance(results, list):
-        results = [results]
+    if scale != 1.0:
+        for face in results:
+            face['region'] = {k: int(round(v / scale)) for k, v in face['region'].items()}
+
+    # Nothing to draw: hand back the input frame without copying it
+    if not results:
+        return image_bgr, results, None
 
     annotated = image_bgr.copy()
+    label_sizes = get_label_sizes()
 
     for face in results:
         region = face.get('region', {})
@@ -144,10 +586,7 @@ def annotate_faces(image_bgr):
 
         # Label background for readability
         label = f"{emotion}"
-        font = cv2.FONT_HERSHEY_SIMPLEX
-        font_scale = 0.8
-        thickness = 2
-        text_size = cv2.getTextSize(label, font, font_scale, thickness)[0]
+        text_size = label_sizes.get(label) or cv2.getTextSize(label, LABEL_FONT, LABEL_FONT_SCALE, LABEL_THICKNESS)[0]
         
         # Draw filled rectangle behind text
         cv2.rectangle(annotated, 
@@ -155,48 +594,184 @@ def annotate_faces(image_bgr):
                       (x + text_size[0] + 4, y), 
                       (0, 255, 0), -1)
         cv2.putText(annotated, label, (x + 2, y - 6),
-                    font, font_scale, (0, 0, 0), thickness)
+                    LABEL_FONT, LABEL_FONT_SCALE, (0, 0, 0), LABEL_THICKNESS)
 
         # Secondary info below box
         info_label = f"Age:{age} | {gender}"
         cv2.putText(annotated, info_label, (x, y + h + 20),
-                    font, 0.55, (0, 255, 0), 1)
+                    LABEL_FONT, 0.55, (0, 255, 0), 1)
 
     return annotated, results, None
 
+def save_face_crop(uploaded_file, filepath):
+    """
+    Save only the largest face in an upload, as a FACE_CROP_SIZE square JPEG.
+    Returns that face's embedding, taken from the same box on the full image as search probes are,
+    or None when the file can't be read or contains no face.
+    """
+    image_bgr = decode_upload(uploaded_file)
+    if image_bgr is None:
+        return None
+    boxes = detect_faces(image_bgr)
+    if not boxes:
+        return None
+
+    x, y, w, h = max(boxes, key=lambda box: box[2] * box[3])
+    # Embed before writing: if the model fails, no crop is left on disk without an index row
+    embedding = embed_faces(image_bgr, [(x, y, w, h)])[0]
+
+    interpolation = cv2.INTER_AREA if max(w, h) > FACE_CROP_SIZE else cv2.INTER_LINEAR
+    face = cv2.resize(image_bgr[y:y + h, x:x + w], (FACE_CROP_SIZE, FACE_CROP_SIZE), interpolation=interpolation)
+    _, jpeg = cv2.imencode(".jpg", face, [cv2.IMWRITE_JPEG_QUALITY, FACE_CROP_JPEG_QUALITY])
+    jpeg.tofile(filepath)  # unlike cv2.imwrite, copes with non-ASCII paths on Windows
+    return embedding
+
+def read_image(path):
+    """cv2.imread that also copes with non-ASCII paths on Windows."""
+    return cv2.imdecode(np.fromfile(path, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+def embed_faces(image_bgr, boxes):
+    """L2-normalised Facenet512 embedding for each (x, y, w, h) face crop, shape (K, 512)."""
+    vectors = []
+    for x, y, w, h in boxes:
+        # Faces are already located by detect_faces, so DeepFace skips its own detector
+        rep = DeepFace.represent(
+            img_path=image_bgr[y:y + h, x:x + w],
+            model_name=RECOGNITION_MODEL,
+            enforce_detection=False,
+            detector_backend='skip'
+        )
+        vectors.append(rep[0]["embedding"])
+    vectors = np.array(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def embed_registered_image(img_path):
+    """Embedding of the face in a training image, used when the index is rebuilt from disk."""
+    image_bgr = read_image(img_path)
+    h, w = image_bgr.shape[:2]
+    if (w, h) == (FACE_CROP_SIZE, FACE_CROP_SIZE):
+        # Written by save_face_crop, so the whole image is the face; re-detecting would crop it again
+        return embed_faces(image_bgr, [(0, 0, w, h)])[0]
+    return embed_faces(image_bgr, [largest_face_box(image_bgr)])[0]  # photo saved before face crops
+
+def index_paths(user_db_path):
+    return (os.path.join(user_db_path, INDEX_EMBEDDINGS_FILE),
+            os.path.join(user_db_path, INDEX_LABELS_FILE))
+
+def save_embedding_index(user_db_path, matrix, labels):
+    emb_path, labels_path = index_paths(user_db_path)
+    np.save(emb_path, matrix.astype(np.float32))
+    save_json_db(labels_path, labels)
+
+def build_embedding_index(user_db_path):
+    """Embed every registered image once and save the (N, 512) matrix with its person labels."""
+    with os.scandir(user_db_path) as entries:
+        people = sorted((e.name, e.path) for e in entries if e.is_dir())
+
+    vectors, labels = [], []
+    for person, person_path in people:
+        with os.scandir(person_path) as files:
+            image_paths = sorted(f.path for f in files if f.name.lower().endswith(IMAGE_EXTENSIONS))
+        for img_path in image_paths:
+            vectors.append(embed_registered_image(img_path))
+            labels.append(person)
+
+    matrix = np.stack(vectors) if vectors else np.empty((0, EMBEDDING_DIM), dtype=np.float32)
+    save_embedding_index(user_db_path, matrix, labels)
+    return matrix, labels
+
+def read_embedding_index(user_db_path):
+    """
+    The saved (matrix, labels), or None if either file is missing.
+    The two files are written one after the other, so an interrupted save can leave them
+    with different row counts; that is treated as missing too, and the index gets rebuilt.
+    """
+    emb_path, labels_path = index_paths(user_db_path)
+    if not (os.path.exists(emb_path) and os.path.exists(labels_path)):
+        return None
+    matrix, labels = np.load(emb_path), load_json_db(labels_path, [])
+    if len(labels) != len(matrix):
+        return None
+    return matrix, labels
+
+def load_embedding_index(user_db_path):
+    """Load a user's saved index, building it first if it doesn't exist yet."""
+    return read_embedding_index(user_db_path) or build_embedding_index(user_db_path)
+
+def append_to_embedding_index(user_db_path, person, embeddings):
+    """Append the embeddings of a person's newly saved images to the index."""
+    index = read_embedding_index(user_db_path)
+    if index is None:
+        build_embedding_index(user_db_path)  # the new images are picked up by the full build
+        return
+
+    matrix, labels = index
+    save_embedding_index(user_db_path,
+                         np.concatenate([matrix, np.stack(embeddings)]),
+                         labels + [person] * len(embeddings))
+
+def remove_from_embedding_index(user_db_path, person):
+    """Drop a deleted person's rows; everyone else keeps their embedding."""
+    index = read_embedding_index(user_db_path)
+    if index is None:
+        return  # rebuilt from the remaining folders on the next search
+
+    matrix, labels = index
+    keep = [i for i, label in enumerate(labels) if label != person]
+    save_embedding_index(user_db_path, matrix[keep], [labels[i] for i in keep])
+
+@st.cache_resource(show_spinner=False)
+def get_search_pool():
+    return ThreadPoolExecutor(max_workers=os.cpu_count() or 1)
+
+def score_embeddings(matrix, probes):
+    """
+    Cosine similarity of every stored row against every probe, shape (N, K).
+    Rows are unit vectors, so this is a plain matrix product. Large indexes are split into row blocks scored on parallel threads
+    (NumPy releases the GIL inside BLAS).
+    """
+    workers = os.cpu_count() or 1
+    if len(matrix) < PARALLEL_SEARCH_MIN_ROWS or workers == 1:
+        return matrix @ probes.T
+    blocks = np.array_split(matrix, workers)
+    return np.concatenate(list(get_search_pool().map(lambda block: block @ probes.T, blocks)))
+
+def has_registered_people(user_db_path):
+    """True if the user has at least one person folder; the index files alone don't count."""
+    if not os.path.isdir(user_db_path):
+        return False
+    with os.scandir(user_db_path) as entries:
+        return any(e.is_dir() for e in entries)
+
 def try_find_face(image_bgr, db_path):
     """
     Try to identify a face against the registered face database.
     Returns a list of matched identity names, or empty list.
     """
-    if not os.path.exists(db_path) or not os.listdir(db_path):
+    if not has_registered_people(db_path):
         return []
 
     try:
-        dfs = DeepFace.find(
-            img_path=image_bgr,
-            db_path=db_path,
-            enforce_detection=False,
-            detector_backend='opencv',
-            silent=True
-        )
-        matches = []
-        for df in dfs:
-            if not df.empty:
-                # Extract person name from path (folder name)
-                for identity_path in df['identity'].tolist():
-                    parts = identity_path.replace("\\", "/").split("/")
-                    # Structure: face_db/<user>/<person_name>/image.jpg
-                    for i, part in enumerate(parts):
-                        if part == FACE_DB_DIR and i + 2 < len(parts):
-                            person_name = parts[i + 2]
-                            if person_name not in matches:
-                                matches.append(person_name)
-                            break
-        return matches
+        matrix, labels = load_embedding_index(db_path)
+        if not labels:
+            return []
+        boxes = detect_faces(image_bgr)
+        if not boxes:
+            return []
+        probes = embed_faces(image_bgr, boxes)
     except Exception:
         return []
 
+    scores = score_embeddings(matrix, probes)
+    best_rows = scores.argmax(axis=0)
+
+    matches = []
+    for probe_idx, row in enumerate(best_rows):
+        person_name = labels[row]
+        if scores[row, probe_idx] >= MATCH_THRESHOLD and person_name not in matches:
+            matches.append(person_name)
+    return matches
+
 
 # --- 3. SESSION STATE ---
 if "logged_in" not in st.session_state:
@@ -206,82 +781,24 @@ if "current_user" not in st.session_state:
 if "theme" not in st.session_state:
     st.session_state.theme = "light"
 if "user_db" not in st.session_state:
-    st.session_state.user_db = load_users()
-if "scan_history" not in st.session_state:
-    st.session_state.scan_history = load_scans()
+    session_users()
 if "last_image" not in st.session_state:
     st.session_state.last_image = None
+if "last_image_bgr" not in st.session_state:
+    st.session_state.last_image_bgr = None
 if "live_running" not in st.session_state:
     st.session_state.live_running = False
 
 
 # --- 4. THEME & STYLING ---
-BUTTON_COLOR = "#005EB8" 
-BUTTON_TEXT_COLOR = "#FFFFFF"
-
-if st.session_state.theme == "dark":
-    bg_color = "#121212"
-    text_color = "#ffffff"
-    input_bg = "#2b2b2b"
-    input_text = "#ffffff"
-    placeholder_color = "#cccccc"
-    dropdown_bg = "#2b2b2b"
-    dropdown_text = "#ffffff"
-else:
-    bg_color = "#F5F7F9"     
-    text_color = "#000000"   
-    input_bg = "#ffffff"
-    input_text = "#000000"
-    placeholder_color = "#555555"
-    dropdown_bg = "#ffffff"
-    dropdown_text = "#000000"
-
-st.markdown(f"""
-    <style>
-    .stApp {{ background-color: {bg_color}; color: {text_color}; }}
-    h1, h2, h3, h4, h5, h6, p, li, .stMarkdown, .stText, label {{ color: {text_color} !important; }}
-
-    input::placeholder {{ color: {placeholder_color} !important; opacity: 1 !important; font-weight: 500; }}
-    .stTextInput > div > div > input {{ background-color: {input_bg} !important; color: {input_text} !important; border: 1px solid #ccc; }}
-    
-    li[role="option"] {{ background-color: {dropdown_bg} !important; color: {dropdown_text} !important; }}
-    div[data-baseweb="popover"] > div {{ background-color: {dropdown_bg} !important; }}
-    li[role="option"]:hover, li[role="option"][aria-selected="true"] {{ background-color: {BUTTON_COLOR} !important; color: white !important; }}
-
-    .stFormSubmitButton > div > div:last-child {{ display: none !important; }}
-
-    div.stButton > button, 
-    button[kind="secondaryFormSubmit"], 
-    button[data-testid="baseButton-secondary"],
-    [data-testid="stFileUploader"] button {{
-        background-color: {BUTTON_COLOR} !important;
-        color: {BUTTON_TEXT_COLOR} !important;
-        border: 1px solid {BUTTON_COLOR} !important;
-        font-weight: bold !important;
-    }}
-
-    div.stButton > button:hover, 
-    button[kind="secondaryFormSubmit"]:hover,
-    button[data-testid="baseButton-secondary"]:hover,
-    [data-testid="stFileUploader"] button:hover {{
-        background-color: #004a94 !important; 
-        color: white !important;
-        border-color: #004a94 !important;
-    }}
-
-    [data-testid="stCameraInput"] {{ background-color: transparent !important; border: none !important; }}
-    [data-testid="stCameraInput"] * {{ color: #FFFFFF !important; fill: #FFFFFF !important; }}
-
-    button[data-baseweb="tab"] {{ color: {text_color} !important; }}
-    </style>
-    """, unsafe_allow_html=True)
+st.markdown(DARK_CSS if st.session_state.theme == "dark" else LIGHT_CSS, unsafe_allow_html=True)
 
 # --- 5. PAGE FUNCTIONS ---
 
 def login_page():
     col1, col2, col3 = st.columns([1, 1.5, 1])
     with col2:
-        if os.path.exists(LOGO_PATH):
+        if LOGO_EXISTS:
             col_a, col_b, col_c = st.columns([1, 2, 1])
             with col_b:
                 st.image(LOGO_PATH, use_container_width=True)
@@ -299,11 +816,15 @@ def login_page():
                 password = st.text_input("Login Pass", type="password", placeholder="Enter Password", label_visibility="collapsed")
                 st.write("")
                 if st.form_submit_button("Login"):
-                    st.session_state.user_db = load_users()
-                    if username in st.session_state.user_db and st.session_state.user_db[username] == password:
+                    stored = session_users().get(username)
+                    # Verified once here; logged_in then skips the KDF on every later rerun
+                    if stored is not None and verify_password(stored, password):
+                        if isinstance(stored, str):
+                            save_new_user(username, password)
                         st.session_state.logged_in = True
                         st.session_state.current_user = username
                         st.session_state.last_image = None
+                        st.session_state.last_image_bgr = None
                         st.session_state.theme = "light" 
                         st.rerun()
                     else:
@@ -314,7 +835,9 @@ def login_page():
                 new_user = st.text_input("New User", placeholder="Create Username", label_visibility="collapsed")
                 new_pass = st.text_input("New Pass", type="password", placeholder="Create Password", label_visibility="collapsed")
                 if st.form_submit_button("Create Account"):
-                    if new_user and new_pass:
+                    if new_user in session_users():
+                        st.error("That username is already taken.")
+                    elif new_user and new_pass:
                         save_new_user(new_user, new_pass)
                         st.success("Account created! Go to the Login tab.")
                     else:
@@ -339,16 +862,20 @@ def recognition_page():
     if final_image:
         st.success("Image captured successfully.")
         if st.button("Process Image ➡️"):
-            st.session_state.last_image = final_image
-            st.switch_page(detection_screen)
+            # Decode once here; the detection page reruns (e.g. on Save) reuse the array
+            cv2_img = decode_upload(final_image)
+            if cv2_img is None:
+                st.error("Could not read this image, or it is too large. Please try another file.")
+            else:
+                st.session_state.last_image = final_image
+                st.session_state.last_image_bgr = cv2_img
+                st.switch_page(detection_screen)
 
 def detection_page():
     st.title("🔍 Detection & Emotion Analysis")
     
-    if st.session_state.last_image:
-        # Convert to PIL then to OpenCV
-        pil_img = Image.open(st.session_state.last_image)
-        cv2_img = pil_to_cv2(pil_img)
+    if st.session_state.last_image and st.session_state.last_image_bgr is not None:
+        cv2_img = st.session_state.last_image_bgr
 
         with st.spinner("🧠 Analyzing face(s) with DeepFace..."):
             annotated_img, results, error = annotate_faces(cv2_img)
@@ -357,8 +884,7 @@ def detection_page():
 
         with col1:
             st.subheader("📸 Annotated Image")
-            annotated_pil = cv2_to_pil(annotated_img)
-            st.image(annotated_pil, caption="Detected faces with emotions", use_container_width=True)
+            st.image(annotated_img, channels="BGR", caption="Detected faces with emotions", use_container_width=True)
 
         with col2:
             if error:
@@ -389,7 +915,7 @@ def detection_page():
                 # --- Face Recognition ---
                 st.divider()
                 user_db_path = os.path.join(FACE_DB_DIR, st.session_state.current_user)
-                if os.path.exists(user_db_path) and os.listdir(user_db_path):
+                if has_registered_people(user_db_path):
                     with st.spinner("🔎 Searching face database..."):
                         matches = try_find_face(cv2_img, user_db_path)
                     if matches:
@@ -403,9 +929,10 @@ def detection_page():
 
         st.divider()
         if st.button("💾 Save Scan & Image to Storage"):
-            saved_filename, saved_path = save_image_locally(
+            saved_filename, _ = save_image_locally(
                 st.session_state.last_image, 
-                st.session_state.current_user
+                st.session_state.current_user,
+                st.session_state.last_image_bgr
             )
             emotion_str = ""
             if results:
@@ -417,8 +944,7 @@ def detection_page():
                 "User": st.session_state.current_user, 
                 "Emotion": emotion_str if emotion_str else "No face detected",
                 "Status": "Analysed", 
-                "File Name": saved_filename,
-                "File Path": saved_path 
+                "File Name": saved_filename
             }
             save_scan_record(new_record)
             st.success(f"✅ Saved: {saved_filename}")
@@ -433,7 +959,7 @@ def training_page():
     
     current_user = st.session_state.current_user
     user_db_path = os.path.join(FACE_DB_DIR, current_user)
-    os.makedirs(user_db_path, exist_ok=True)
+    ensure_dir(user_db_path)
 
     # --- Register New Person ---
     st.subheader("➕ Register a New Person")
@@ -461,35 +987,40 @@ def training_page():
         else:
             person_folder = os.path.join(user_db_path, person_name.strip())
             os.makedirs(person_folder, exist_ok=True)
-            saved_count = 0
-
-            # Save camera capture
+            # Only the largest face is kept, as a fixed-size crop; photos without a face are skipped
+            timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+            uploads = []
             if cam_img:
-                timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                filepath = os.path.join(person_folder, f"cam_{timestamp}.jpg")
-                with open(filepath, "wb") as f:
-                    f.write(cam_img.getbuffer())
-                saved_count += 1
-
-            # Save uploaded files
-            if uploaded_files:
-                for idx, ufile in enumerate(uploaded_files):
-                    timestamp = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                    ext = os.path.splitext(ufile.name)[1] if hasattr(ufile, 'name') else ".jpg"
-                    filepath = os.path.join(person_folder, f"upload_{timestamp}_{idx}{ext}")
-                    with open(filepath, "wb") as f:
-                        f.write(ufile.getbuffer())
-                    saved_count += 1
-
-            if saved_count > 0:
-                # Clear any cached representations so DeepFace re-indexes
-                pkl_files = [f for f in os.listdir(user_db_path) if f.endswith('.pkl')]
-                for pkl in pkl_files:
-                    try: os.remove(os.path.join(user_db_path, pkl))
-                    except: pass
-                st.success(f"✅ Saved {saved_count} image(s) for **{person_name.strip()}**!")
-                st.rerun()
-            else:
+                uploads.append((cam_img, f"cam_{timestamp}.jpg"))
+            for idx, ufile in enumerate(uploaded_files or []):
+                uploads.append((ufile, f"upload_{timestamp}_{idx}.jpg"))
+
+            embeddings, skipped, failed = [], [], []
+            with st.spinner("Detecting and embedding faces..."):
+                for upload, filename in uploads:
+                    try:
+                        embedding = save_face_crop(upload, os.path.join(person_folder, filename))
+                    except Exception as e:
+                        failed.append(f"{getattr(upload, 'name', filename)} ({e})")
+                        continue
+                    if embedding is not None:
+                        embeddings.append(embedding)
+                    else:
+                        skipped.append(getattr(upload, 'name', filename))
+
+            if skipped:
+                st.warning(f"⚠️ No face found in: {', '.join(skipped)}")
+            if failed:
+                st.error(f"Could not process: {', '.join(failed)}")
+
+            if embeddings:
+                # Only the new images are added; everything already registered keeps its row
+                with st.spinner("Updating face index..."):
+                    append_to_embedding_index(user_db_path, person_name.strip(), embeddings)
+                st.success(f"✅ Saved {len(embeddings)} image(s) for **{person_name.strip()}**!")
+                if not skipped and not failed:
+                    st.rerun()
+            elif not uploads:
                 st.warning("No images provided. Please capture or upload at least one image.")
 
     # --- View Registered People ---
@@ -497,14 +1028,14 @@ def training_page():
     st.subheader("📋 Registered People")
     
     if os.path.exists(user_db_path):
-        people = [d for d in os.listdir(user_db_path) 
-                  if os.path.isdir(os.path.join(user_db_path, d))]
+        # scandir entries already know their type, so there's no extra stat per entry
+        with os.scandir(user_db_path) as entries:
+            people = [(e.name, e.path) for e in entries if e.is_dir()]
         
         if people:
-            for person in people:
-                person_path = os.path.join(user_db_path, person)
-                images = [f for f in os.listdir(person_path) 
-                         if f.lower().endswith(('.jpg', '.jpeg', '.png'))]
+            for person, person_path in people:
+                with os.scandir(person_path) as files:
+                    images = [f.name for f in files if f.name.lower().endswith(IMAGE_EXTENSIONS)]
                 
                 with st.expander(f"👤 {person} — {len(images)} image(s)"):
                     if images:
@@ -518,13 +1049,8 @@ def training_page():
                             st.caption(f"... and {len(images) - 4} more image(s)")
                     
                     if st.button(f"🗑️ Delete {person}", key=f"del_{person}"):
-                        import shutil
                         shutil.rmtree(person_path)
-                        # Clear pkl cache
-                        pkl_files = [f for f in os.listdir(user_db_path) if f.endswith('.pkl')]
-                        for pkl in pkl_files:
-                            try: os.remove(os.path.join(user_db_path, pkl))
-                            except: pass
+                        remove_from_embedding_index(user_db_path, person)
                         st.success(f"Deleted **{person}** from database.")
                         st.rerun()
         else:
@@ -532,80 +1058,103 @@ def training_page():
     else:
         st.info("No face database found. Start by registering a person above.")
 
+# Frames are analysed on streamlit-webrtc's worker thread; results reach the page through this queue
+live_results = queue.Queue()
+
+def analyze_live_frame(frame):
+    """streamlit-webrtc callback: annotate one video frame in-process, no Streamlit rerun."""
+    annotated_img, results, error = annotate_faces(frame.to_ndarray(format="bgr24"))
+    live_results.put((results, error))
+    return av.VideoFrame.from_ndarray(np.ascontiguousarray(annotated_img), format="bgr24")
+
+def show_live_results(results, error):
+    if error:
+        st.error(f"Error: {error}")
+    elif results:
+        for i, face in enumerate(results):
+            emotion = face.get('dominant_emotion', 'N/A')
+            age = face.get('age', '?')
+            gender = face.get('dominant_gender', '?')
+            
+            st.markdown(f"""
+            ### Face #{i+1}
+            | Attribute | Value |
+            |-----------|-------|
+            | **Emotion** | {emotion} |
+            | **Age** | {age} |
+            | **Gender** | {gender} |
+            """)
+            
+            # Mini emotion bars
+            emotions = face.get('emotion', {})
+            if emotions:
+                top_3 = sorted(emotions.items(), key=lambda x: x[1], reverse=True)[:3]
+                for emo_name, emo_val in top_3:
+                    st.progress(emo_val / 100, text=f"{emo_name}: {emo_val:.1f}%")
+    else:
+        st.info("No faces detected. Try adjusting your position.")
+
 def live_emotion_page():
     st.title("🎭 Live Emotion Detection")
-    st.write("Capture frames from your webcam to detect emotions in real time.")
-    st.caption("Each captured frame is analysed for faces and emotions. "
+    st.write("Stream your webcam to detect emotions in real time.")
+    st.caption("Every frame is analysed for faces and emotions. "
                "A green bounding box is drawn around detected faces with the emotion label.")
 
     st.divider()
 
-    # Camera input — each time the user takes a photo, it's analysed
-    img_file = st.camera_input("📷 Capture a frame for emotion analysis", key="live_emotion_cam")
-
-    if img_file is not None:
-        # Convert to OpenCV
-        pil_img = Image.open(img_file)
-        cv2_img = pil_to_cv2(pil_img)
-
-        with st.spinner("Analysing emotions..."):
-            annotated_img, results, error = annotate_faces(cv2_img)
+    # Load what analysis will use here, on the script thread, before frames start arriving.
+    # Keras models are only built for attributes that have no ONNX session.
+    get_face_detector()
+    onnx_sessions = get_onnx_sessions()
+    for name in ATTRIBUTE_MODELS:
+        if name not in onnx_sessions:
+            get_attribute_model(name)
 
-        col1, col2 = st.columns([1.2, 0.8])
+    col1, col2 = st.columns([1.2, 0.8])
 
-        with col1:
-            annotated_pil = cv2_to_pil(annotated_img)
-            st.image(annotated_pil, caption="Live Analysis", use_container_width=True)
+    with col1:
+        # async_processing drops stale frames while the previous one is still being analysed
+        ctx = webrtc_streamer(
+            key="live_emotion",
+            mode=WebRtcMode.SENDRECV,
+            video_frame_callback=analyze_live_frame,
+            media_stream_constraints={"video": True, "audio": False},
+            async_processing=True,
+        )
 
-        with col2:
-            if error:
-                st.error(f"Error: {error}")
-            elif results:
-                for i, face in enumerate(results):
-                    emotion = face.get('dominant_emotion', 'N/A')
-                    age = face.get('age', '?')
-                    gender = face.get('dominant_gender', '?')
-                    
-                    st.markdown(f"""
-                    ### Face #{i+1}
-                    | Attribute | Value |
-                    |-----------|-------|
-                    | **Emotion** | {emotion} |
-                    | **Age** | {age} |
-                    | **Gender** | {gender} |
-                    """)
-                    
-                    # Mini emotion bars
-                    emotions = face.get('emotion', {})
-                    if emotions:
-                        top_3 = sorted(emotions.items(), key=lambda x: x[1], reverse=True)[:3]
-                        for emo_name, emo_val in top_3:
-                            st.progress(emo_val / 100, text=f"{emo_name}: {emo_val:.1f}%")
-            else:
-                st.info("No faces detected. Try adjusting your position.")
-        
-        st.caption("💡 **Tip:** Click the camera button again to capture another frame and see updated emotions!")
-    else:
-        st.info("👆 Click the camera button above to start capturing frames.")
+    with col2:
+        results_area = st.empty()
+        if not ctx.state.playing:
+            results_area.info("👆 Press START to begin streaming from your webcam.")
+
+        while ctx.state.playing:
+            try:
+                results, error = live_results.get(timeout=1.0)
+            except queue.Empty:
+                continue
+            # Only the newest frame's results are worth drawing
+            while not live_results.empty():
+                results, error = live_results.get_nowait()
+            with results_area.container():
+                show_live_results(results, error)
 
 def storage_page():
     st.title("📂 Data Storage")
     
-    full_history = st.session_state.scan_history
     current_user = st.session_state.current_user
-    user_scans = [scan for scan in full_history if scan.get('User') == current_user]
+    user_scans = load_scans(current_user)
     
     if not user_scans:
         st.info(f"No scans found for user: {current_user}")
     else:
-        df = pd.DataFrame(user_scans)
-        display_cols = [c for c in df.columns if c != "File Path"]
-        st.dataframe(df[display_cols], use_container_width=True)
+        st.dataframe(user_scans, use_container_width=True)
         st.divider()
         
         st.subheader("Manage Records")
         
-        options = [r['File Name'] for r in user_scans]
+        # One pass builds both the selectbox options and an O(1) lookup for the preview
+        scans_by_name = {r['File Name']: r for r in user_scans}
+        options = list(scans_by_name)
         
         col_list, col_preview, col_btn = st.columns([2, 2, 1])
         
@@ -614,9 +1163,15 @@ def storage_page():
         
         with col_preview:
             if selected_filename:
-                selected_record = next((item for item in user_scans if item["File Name"] == selected_filename), None)
-                if selected_record and os.path.exists(selected_record["File Path"]):
-                    st.image(selected_record["File Path"], caption="Preview", use_container_width=True)
+                selected_record = scans_by_name.get(selected_filename)
+                existing = scan_files(current_user)
+                if selected_record and selected_filename in existing:
+                    full_path = scan_path(current_user, selected_filename)
+                    # Older scans have no thumbnail, so they preview from the full image
+                    preview_path = thumb_path(full_path) if thumb_path(selected_filename) in existing else full_path
+                    st.image(preview_path, caption="Preview", use_container_width=True)
+                    if preview_path != full_path and st.checkbox("Show full image", key=f"full_{selected_filename}"):
+                        st.image(full_path, use_container_width=True)
                 else:
                     st.warning("Image file missing")
 
@@ -625,7 +1180,7 @@ def storage_page():
             st.write("")
             if st.button("Delete Selected 🗑️"):
                 if selected_filename:
-                    delete_scan_by_filename(selected_filename)
+                    delete_scan_by_filename(selected_filename, current_user)
 
 def settings_page():
     st.title("⚙️ Settings")
@@ -644,6 +1199,7 @@ def settings_page():
         st.session_state.logged_in = False
         st.session_state.current_user = None 
         st.session_state.last_image = None
+        st.session_state.last_image_bgr = None
         st.session_state.theme = "light" 
         st.rerun()
 
@@ -670,5 +1226,9 @@ pg.run()
 # To stop >>> ctrl + C 
 # username = admin password = 1234 < This needs to be deleted for security reasons at the end
 #
-# pip install streamlit pandas pillow deepface opencv-python tf-keras
+# pip install streamlit pillow deepface opencv-python tf-keras streamlit-webrtc orjson
+# GPU (optional): pip install "tensorflow[and-cuda]"
+# YuNet face detector (optional, Haar cascade otherwise): download face_detection_yunet_2023mar.onnx into models/ from
+#   https://github.com/opencv/opencv_zoo/tree/main/models/face_detection_yunet
+# ONNX/TensorRT (optional): pip install onnxruntime-gpu tf2onnx onnxconverter-common, then python export_onnx.py
 # 
\ No newline at end of file
@@ -0,0 +1,34 @@
+"""
+One-off export of the DeepFace emotion/age/gender models to FP16 ONNX.
+
+Run once:  python export_onnx.py
+app.py loads the files from MODELS_DIR with ONNX Runtime (TensorRT/CUDA
+when available) and falls back to the Keras models when they are missing.
+"""
+import os
+
+import onnx
+import tensorflow as tf
+import tf2onnx
+from deepface import DeepFace
+from onnxconverter_common import float16
+
+MODELS_DIR = "models"
+ATTRIBUTE_MODELS = ("Emotion", "Age", "Gender")
+
+
+def export_model(name):
+    keras_model = DeepFace.build_model(model_name=name, task="facial_attribute").model
+    spec = (tf.TensorSpec((None,) + tuple(keras_model.input_shape[1:]), tf.float32, name="input"),)
+    onnx_model, _ = tf2onnx.convert.from_keras(keras_model, input_signature=spec, opset=13)
+    onnx_model = float16.convert_float_to_float16(onnx_model)
+
+    path = os.path.join(MODELS_DIR, f"{name.lower()}_fp16.onnx")
+    onnx.save(onnx_model, path)
+    return path
+
+
+if __name__ == "__main__":
+    os.makedirs(MODELS_DIR, exist_ok=True)
+    for model_name in ATTRIBUTE_MODELS:
+        print(f"Exported {model_name} -> {export_model(model_name)}")
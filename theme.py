@@ -0,0 +1,88 @@
+"""
+Light/dark stylesheets for the Streamlit app.
+
+Streamlit re-executes app.py on every rerun, but imported modules are only
+loaded once per process, so both stylesheets are formatted a single time here.
+"""
+
+import string
+
+BUTTON_COLOR = "#005EB8"
+BUTTON_TEXT_COLOR = "#FFFFFF"
+
+
+# Parsed once; build_theme_css only substitutes colours into it
+THEME_TEMPLATE = string.Template("""
+    <style>
+    .stApp { background-color: $bg_color; color: $text_color; }
+    h1, h2, h3, h4, h5, h6, p, li, .stMarkdown, .stText, label { color: $text_color !important; }
+
+    input::placeholder { color: $placeholder_color !important; opacity: 1 !important; font-weight: 500; }
+    .stTextInput > div > div > input { background-color: $input_bg !important; color: $input_text !important; border: 1px solid #ccc; }
+    
+    li[role="option"] { background-color: $dropdown_bg !important; color: $dropdown_text !important; }
+    div[data-baseweb="popover"] > div { background-color: $dropdown_bg !important; }
+    li[role="option"]:hover, li[role="option"][aria-selected="true"] { background-color: $button_color !important; color: white !important; }
+
+    .stFormSubmitButton > div > div:last-child { display: none !important; }
+
+    div.stButton > button, 
+    button[kind="secondaryFormSubmit"], 
+    button[data-testid="baseButton-secondary"],
+    [data-testid="stFileUploader"] button {
+        background-color: $button_color !important;
+        color: $button_text_color !important;
+        border: 1px solid $button_color !important;
+        font-weight: bold !important;
+    }
+
+    div.stButton > button:hover, 
+    button[kind="secondaryFormSubmit"]:hover,
+    button[data-testid="baseButton-secondary"]:hover,
+    [data-testid="stFileUploader"] button:hover {
+        background-color: #004a94 !important; 
+        color: white !important;
+        border-color: #004a94 !important;
+    }
+
+    [data-testid="stCameraInput"] { background-color: transparent !important; border: none !important; }
+    [data-testid="stCameraInput"] * { color: #FFFFFF !important; fill: #FFFFFF !important; }
+
+    button[data-baseweb="tab"] { color: $text_color !important; }
+    </style>
+    """)
+
+
+def build_theme_css(bg_color, text_color, input_bg, input_text, placeholder_color, dropdown_bg, dropdown_text):
+    return THEME_TEMPLATE.substitute(
+        bg_color=bg_color,
+        text_color=text_color,
+        input_bg=input_bg,
+        input_text=input_text,
+        placeholder_color=placeholder_color,
+        dropdown_bg=dropdown_bg,
+        dropdown_text=dropdown_text,
+        button_color=BUTTON_COLOR,
+        button_text_color=BUTTON_TEXT_COLOR,
+    )
+
+
+LIGHT_CSS = build_theme_css(
+    bg_color="#F5F7F9",
+    text_color="#000000",
+    input_bg="#ffffff",
+    input_text="#000000",
+    placeholder_color="#555555",
+    dropdown_bg="#ffffff",
+    dropdown_text="#000000",
+)
+
+DARK_CSS = build_theme_css(
+    bg_color="#121212",
+    text_color="#ffffff",
+    input_bg="#2b2b2b",
+    input_text="#ffffff",
+    placeholder_color="#cccccc",
+    dropdown_bg="#2b2b2b",
+    dropdown_text="#ffffff",
+)